@@ -1,63 +1,215 @@
+# Serve sockets from gevent greenlets when it is installed, so one process can hold
+# thousands of idle WebSocket connections. Monkey patching must run before anything imports socket.
+try:
+    from gevent import monkey
+    monkey.patch_all()
+    ASYNC_MODE = 'gevent'
+except ImportError:
+    ASYNC_MODE = 'threading'
+
 import base64
-from datetime import datetime
-from flask import Flask, render_template_string, request
-from flask_socketio import SocketIO, join_room, leave_room, emit
+import gzip
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+from flask import Flask, Response, request
+from flask_socketio import SocketIO, join_room, leave_room, emit, rooms
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; python_pseudo_encrypt falls back to pure Python
+    np = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; packets and history are encoded with the stdlib json module
+    orjson = None
+
+
+class OrjsonCodec:
+    """json-module stand-in that encodes with orjson. orjson always produces compact output, so
+    formatting options such as separators only matter on the stdlib fallback. Lone surrogates
+    and integers beyond 64 bits are rejected by orjson, so such values go through the stdlib
+    both ways."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return json.dumps(obj, **kwargs)
+
+    loads = staticmethod(json.loads)
+
+
+JSON_CODEC = OrjsonCodec if orjson is not None else json
 
 # --- Configuration ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# With several server processes, set SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0)
+# so that broadcasts reach clients connected to any of them
+MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
+                    ping_interval=25, ping_timeout=60,
+                    message_queue=MESSAGE_QUEUE, json=JSON_CODEC)
 
 # --- In-Memory Database (Replaces Firestore) ---
 # In a real app, you would use SQLite or PostgreSQL
-DATA_STORE = {
-    'general': [],
-    'tech': [],
-    'random': []
-}
+# History is bounded on the server, so a join never transfers more than this many messages per room
+HISTORY_LIMIT = 50
+
+class RingBuffer:
+    """Fixed-capacity message history. The slot list is allocated once; once full,
+    each push overwrites the oldest message in place."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buf = [None] * capacity
+        self.head = 0   # next slot to write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, item):
+        self.buf[self.head] = item
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def snapshot(self):
+        """Return the stored messages, oldest first, as a new list (at most two slices)."""
+        start = self.head - self.count
+        if start >= 0:
+            return self.buf[start:self.head]
+        return self.buf[start:] + self.buf[:self.head]
+
+ROOMS = frozenset({'general', 'tech', 'random'})
+
+# The history of each room is a ring of messages JSON-encoded once, on arrival.
+# Read-only views: the set of rooms is fixed, and clients can never add keys to them.
+HISTORY_JSON = MappingProxyType({room: RingBuffer(HISTORY_LIMIT) for room in ROOMS})
+
+# The '[...]' blob sent on join is rebuilt lazily: a new message only marks it stale (None),
+# and the next join re-joins the strings, so sending never pays for it
+HISTORY_BLOB = {room: '[]' for room in ROOMS}
+_history_locks = MappingProxyType({room: threading.Lock() for room in ROOMS})
+
+def history_blob(room):
+    with _history_locks[room]:
+        blob = HISTORY_BLOB[room]
+        if blob is None:
+            blob = HISTORY_BLOB[room] = '[' + ','.join(HISTORY_JSON[room].snapshot()) + ']'
+        return blob
 
 # --- Helper Functions (Python Version of the Encryption) ---
 # Note: In this architecture, we perform encryption on the CLIENT (JS)
 # to maintain "End-to-End" security simulation. However, here is 
-# how you would do the same logic in Python if you wanted server-side processing.
+# how you would do the client's XOR fallback (pseudoEncrypt) in Python if you wanted
+# server-side processing. Clients served over https use AES-GCM instead, which this does not cover.
+
+# Below this many bytes, bytes.translate beats NumPy's fixed per-call overhead
+NUMPY_MIN_BYTES = 4096
+
+# 256-byte XOR translation tables, one per key (keys are single bytes, so at most 256 tables)
+_XOR_TABLES = {}
+
+def _xor_table(key):
+    table = _XOR_TABLES.get(key)
+    if table is None:
+        table = _XOR_TABLES[key] = bytes(i ^ key for i in range(256))
+    return table
+
+# The client's hardcoded key; its table is built up front so the common call skips the memo lookup
+_XOR_TABLE_123 = _xor_table(123)
+
 def python_pseudo_encrypt(text, key=123):
     try:
         # 1. Encode to UTF-8 bytes
         text_bytes = text.encode('utf-8')
-        # 2. XOR each byte
-        xor_bytes = bytearray(b ^ key for b in text_bytes)
+        # 2. XOR each byte: a table lookup in C via bytes.translate, or one vectorized
+        #    NumPy operation for large payloads
+        if np is not None and len(text_bytes) >= NUMPY_MIN_BYTES:
+            xor_bytes = np.bitwise_xor(np.frombuffer(text_bytes, dtype=np.uint8), np.uint8(key)).tobytes()
+        elif key == 123:
+            xor_bytes = text_bytes.translate(_XOR_TABLE_123)
+        else:
+            xor_bytes = text_bytes.translate(_xor_table(key))
         # 3. Base64 Encode
         return base64.b64encode(xor_bytes).decode('ascii')
     except Exception as e:
         print(f"Encryption error: {e}")
         return text
 
+# The '%I:%M %p' label only changes once a minute, so it is formatted once per minute.
+# The (minute, label) tuple is swapped in as a whole, so concurrent handlers always read a matching pair.
+_minute_label = (-1, '')
+
+def server_timestamp():
+    global _minute_label
+    now = time.time()
+    minute = int(now // 60)
+    if _minute_label[0] != minute:
+        _minute_label = (minute, time.strftime('%I:%M %p', time.localtime(now)))
+    return _minute_label[1]
+
 # --- Routes ---
 @app.route('/')
 def index():
-    # We render the single-page UI defined at the bottom of this file
-    return render_template_string(HTML_TEMPLATE)
+    # We serve the single-page UI defined at the bottom of this file.
+    # It has no template variables, so its bytes (plain and gzipped) are built once at import time.
+    # Compare the quality, not membership: 'gzip;q=0' is listed but means "never gzip"
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(INDEX_HTML_GZIP, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(INDEX_HTML, mimetype='text/html')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
 # --- Socket Events (Real-time Logic) ---
 
+def is_known_room(data):
+    # Client payloads are untrusted: anything but a dict naming one of ROOMS (as a string) is ignored
+    return isinstance(data, dict) and isinstance(data.get('room'), str) and data['room'] in ROOMS
+
+def is_membership_request(data):
+    # join/leave also announce the user by name, so they need a string username as well
+    return is_known_room(data) and isinstance(data.get('username'), str)
+
 @socketio.on('join')
 def on_join(data):
+    # Ignore unknown rooms and malformed payloads instead of raising inside the socket handler
+    if not is_membership_request(data):
+        return
     username = data['username']
     room = data['room']
+    # Already subscribed: skip the history replay and the status broadcast entirely
+    if room in rooms():
+        return
     join_room(room)
     
-    # Send existing messages for this room to the user who just joined
-    emit('load_history', DATA_STORE[room], to=request.sid)
+    # Send existing messages for this room to the user who just joined (pre-serialized).
+    # The client is connected to this process, so the message queue can be bypassed.
+    emit('load_history_raw', history_blob(room), to=request.sid, ignore_queue=True)
     
     # Notify others
-    emit('status', {'msg': f'{username} has entered the room.'}, room=room)
+    emit('status', {'msg': f'{username} has entered the room.'}, room=room, include_self=False)
 
 @socketio.on('leave')
 def on_leave(data):
+    if not is_membership_request(data):
+        return
     username = data['username']
     room = data['room']
+    if room not in rooms():
+        return
     leave_room(room)
-    emit('status', {'msg': f'{username} has left the room.'}, room=room)
+    emit('status', {'msg': f'{username} has left the room.'}, room=room, include_self=False)
 
 @socketio.on('send_message')
 def handle_message(data):
@@ -65,20 +217,26 @@ def handle_message(data):
     Receives message from client. 
     Data includes: {text, sender, room, isEncrypted, timestamp}
     """
+    if not is_known_room(data):
+        return
     room = data['room']
     
+    # Avatars are derived from the sender on the client; drop any URL a stale client still sends
+    data.pop('avatar', None)
+
     # Add server-side timestamp
-    data['timestamp'] = datetime.now().strftime('%I:%M %p')
-    
-    # Store in memory
-    DATA_STORE[room].append(data)
+    data['timestamp'] = server_timestamp()
     
-    # Keep only last 50 messages (Cleanup)
-    if len(DATA_STORE[room]) > 50:
-        DATA_STORE[room].pop(0)
+    # Store in memory (the ring buffer overwrites the oldest message past HISTORY_LIMIT)
+    encoded = JSON_CODEC.dumps(data, separators=(',', ':'))
+    with _history_locks[room]:
+        HISTORY_JSON[room].push(encoded)
+        HISTORY_BLOB[room] = None
 
-    # Broadcast to everyone in the room
-    emit('receive_message', data, room=room)
+    # Broadcast to everyone in the room, unless nobody is subscribed (e.g. all mid-reconnect).
+    # Only this process's subscribers are visible here, so with a shared queue always publish.
+    if MESSAGE_QUEUE or socketio.server.manager.rooms.get('/', {}).get(room):
+        emit('receive_message', data, room=room)
 
 # --- The Frontend Template (Replicates the React UI) ---
 HTML_TEMPLATE = """
@@ -96,6 +254,8 @@ HTML_TEMPLATE = """
         ::-webkit-scrollbar { width: 8px; }
         ::-webkit-scrollbar-track { background: #1e293b; }
         ::-webkit-scrollbar-thumb { background: #475569; border-radius: 4px; }
+        /* Let the browser skip layout and paint for messages scrolled out of view */
+        .message-row { content-visibility: auto; contain-intrinsic-size: auto 72px; }
     </style>
 </head>
 <body class="bg-slate-900 text-slate-100 font-sans h-screen flex overflow-hidden">
@@ -153,8 +313,10 @@ HTML_TEMPLATE = """
                 </button>
             </header>
 
-            <div id="messages-container" class="flex-1 overflow-y-auto p-6 space-y-6">
-                </div>
+            <div id="messages-container" class="flex-1 overflow-y-auto p-6">
+                <div id="message-list" class="space-y-6"></div>
+                <div id="messages-end" class="h-px"></div>
+            </div>
 
             <div class="p-4 bg-slate-800 border-t border-slate-700">
                 <form id="message-form" class="flex items-center gap-2">
@@ -168,37 +330,250 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
-    <script>
-        // --- CLIENT SIDE LOGIC ---
-        const socket = io();
-        let currentUser = null;
-        let activeRoom = 'general';
-        let isEncrypted = false;
-        const rooms = ['general', 'tech', 'random'];
-
+    <!-- Crypto helpers: run on the page and, from the same source, inside the crypto worker -->
+    <script id="crypto-core">
         // --- Crypto Helper Functions (Matching the React Logic) ---
+        // XOR a buffer with a single-byte key in place, one 32-bit word (four bytes) per step.
+        // The buffer length must be a multiple of 4; callers pad and take a subarray afterwards.
+        const xorWords = (padded, key) => {
+            const words = new Uint32Array(padded.buffer, padded.byteOffset, padded.length >> 2);
+            const k32 = (key | (key << 8) | (key << 16) | (key << 24)) >>> 0;
+            for (let i = 0; i < words.length; i++) words[i] ^= k32;
+            return padded;
+        };
+
+        // 256-entry XOR lookup tables, one per key. Decoding base64 already visits every byte once,
+        // so decryption folds the XOR into that copy instead of running a second pass.
+        const XOR_TABLES = new Map();
+        const xorTable = (key) => {
+            let table = XOR_TABLES.get(key);
+            if (!table) {
+                table = new Uint8Array(256);
+                for (let i = 0; i < 256; i++) table[i] = i ^ key;
+                XOR_TABLES.set(key, table);
+            }
+            return table;
+        };
+
+        // Scratch space for decoded ciphertext, grown on demand and reused across calls. Safe because
+        // TextDecoder copies the bytes into a new string before the buffer is written again.
+        let scratch = new Uint8Array(1024);
+        const scratchBytes = (length) => {
+            if (scratch.length < length) scratch = new Uint8Array(Math.max(length, scratch.length * 2));
+            return scratch.subarray(0, length);
+        };
+
+        const BINARY_CHUNK = 0x8000;
+        // Shared codec instances; both are stateless when used without the stream option
+        const UTF8_ENCODER = new TextEncoder();
+        const UTF8_DECODER = new TextDecoder();
+
+        // Bytes <-> base64. The binary string is built in 32K-byte chunks to stay under the engine's argument limit
+        const bytesToBase64 = (bytes) => {
+            let binary = '';
+            for (let i = 0; i < bytes.length; i += BINARY_CHUNK) {
+                binary += String.fromCharCode.apply(null, bytes.subarray(i, i + BINARY_CHUNK));
+            }
+            return btoa(binary);
+        };
+
+        const base64ToBytes = (b64) => {
+            const binary = atob(b64);
+            const bytes = new Uint8Array(binary.length);
+            for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+            return bytes;
+        };
+
         const pseudoEncrypt = (text, key = 123) => {
             try {
-                const encoder = new TextEncoder();
-                const bytes = encoder.encode(text);
-                const xorBytes = bytes.map(byte => byte ^ key);
-                let binary = '';
-                for (let i = 0; i < xorBytes.length; i++) binary += String.fromCharCode(xorBytes[i]);
-                return btoa(binary);
+                const bytes = UTF8_ENCODER.encode(text);
+                const padded = new Uint8Array((bytes.length + 3) & ~3);
+                padded.set(bytes);
+                const xorBytes = xorWords(padded, key).subarray(0, bytes.length);
+                return bytesToBase64(xorBytes);
             } catch (e) { return text; }
         };
 
         const pseudoDecrypt = (cipherText, key = 123) => {
             try {
                 const binary = atob(cipherText);
-                const bytes = new Uint8Array(binary.length);
-                for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
-                const originalBytes = bytes.map(byte => byte ^ key);
-                const decoder = new TextDecoder();
-                return decoder.decode(originalBytes);
+                const table = xorTable(key);
+                const originalBytes = scratchBytes(binary.length);
+                for (let i = 0; i < binary.length; i++) originalBytes[i] = table[binary.charCodeAt(i)];
+                return UTF8_DECODER.decode(originalBytes);
+            } catch (e) { return "**Encrypted Data**"; }
+        };
+
+        // --- Web Crypto (AES-GCM) ---
+        // Messages are sent with AES-GCM only when the page is served over https. crypto.subtle alone
+        // is not enough: it also exists on http://localhost, while peers joining the same server over
+        // http://<LAN-IP> lack it and could not read those messages. Payloads are "<iv>.<ciphertext>"
+        // in base64; '.' is not a base64 character, so legacy XOR payloads stay readable.
+        // Like the XOR key, the per-channel keys are derived from a secret hardcoded in the client.
+        const CHANNEL_SECRET = 'securechat-v2';
+        const hasSubtleCrypto = !!(globalThis.crypto && crypto.subtle);
+        const sendsAes = hasSubtleCrypto && globalThis.location?.protocol === 'https:';
+        const channelKeys = new Map();
+
+        const channelKey = (room) => {
+            let key = channelKeys.get(room);
+            if (!key) {
+                key = crypto.subtle.digest('SHA-256', UTF8_ENCODER.encode(`${CHANNEL_SECRET}:${room}`))
+                    .then(raw => crypto.subtle.importKey('raw', raw, { name: 'AES-GCM' }, false, ['encrypt', 'decrypt']));
+                channelKeys.set(room, key);
+            }
+            return key;
+        };
+
+        const aesEncrypt = async (text, room) => {
+            const iv = crypto.getRandomValues(new Uint8Array(12));
+            const cipher = await crypto.subtle.encrypt({ name: 'AES-GCM', iv }, await channelKey(room), UTF8_ENCODER.encode(text));
+            return `${bytesToBase64(iv)}.${bytesToBase64(new Uint8Array(cipher))}`;
+        };
+
+        const aesDecrypt = async (payload, room) => {
+            try {
+                const [iv, cipher] = payload.split('.');
+                const plain = await crypto.subtle.decrypt({ name: 'AES-GCM', iv: base64ToBytes(iv) }, await channelKey(room), base64ToBytes(cipher));
+                return UTF8_DECODER.decode(plain);
             } catch (e) { return "**Encrypted Data**"; }
         };
 
+        const encryptMessage = async (text, room) => sendsAes ? aesEncrypt(text, room) : pseudoEncrypt(text);
+
+        const decryptMessage = async (payload, room) => {
+            if (typeof payload !== 'string') return "**Encrypted Data**"; // hand-built clients can send anything
+            if (!payload.includes('.')) return pseudoDecrypt(payload);
+            return hasSubtleCrypto ? aesDecrypt(payload, room) : "**Encrypted Data**";
+        };
+
+        // Bulk XOR decrypt: every ciphertext is XORed through the lookup table into one shared
+        // buffer in a single pass, and each plaintext is then decoded from its own slice
+        const pseudoDecryptBatch = (cipherTexts, key = 123) => {
+            const binaries = cipherTexts.map(cipherText => { try { return atob(cipherText); } catch (e) { return null; } });
+            const total = binaries.reduce((sum, binary) => sum + (binary ? binary.length : 0), 0);
+            const table = xorTable(key);
+            const bytes = scratchBytes(total);
+            const offsets = [];
+            let offset = 0;
+            for (const binary of binaries) {
+                offsets.push(offset);
+                if (!binary) continue;
+                for (let i = 0; i < binary.length; i++) bytes[offset + i] = table[binary.charCodeAt(i)];
+                offset += binary.length;
+            }
+            return binaries.map((binary, i) => binary === null
+                ? "**Encrypted Data**"
+                : UTF8_DECODER.decode(bytes.subarray(offsets[i], offsets[i] + binary.length)));
+        };
+
+        // Decrypt a batch of {text, room} items; XOR payloads share one bulk pass, AES ones run concurrently
+        const decryptItems = async (items) => {
+            const texts = new Array(items.length);
+            const xorIndexes = [];
+            const aesJobs = [];
+            items.forEach(({ text, room }, i) => {
+                if (typeof text !== 'string') texts[i] = "**Encrypted Data**";
+                else if (text.includes('.')) aesJobs.push(decryptMessage(text, room).then(plain => { texts[i] = plain; }));
+                else xorIndexes.push(i);
+            });
+            pseudoDecryptBatch(xorIndexes.map(i => items[i].text)).forEach((plain, j) => { texts[xorIndexes[j]] = plain; });
+            await Promise.all(aesJobs);
+            return texts;
+        };
+    </script>
+
+    <script>
+        // --- CLIENT SIDE LOGIC ---
+        const socket = io();
+        let currentUser = null;
+        let activeRoom = 'general';
+        let joinedRoom = null; // room this socket is actually subscribed to on the server
+        let isEncrypted = false;
+        const rooms = Object.freeze(['general', 'tech', 'random']);
+
+        // Avatars are derived from the sender name rather than sent with every message;
+        // memoised so all messages from one sender share the same URL string
+        const avatarUrls = new Map();
+        const avatarFor = (sender) => {
+            let url = avatarUrls.get(sender);
+            if (!url) {
+                url = `https://api.dicebear.com/7.x/avataaars/svg?seed=${sender}`;
+                avatarUrls.set(sender, url);
+            }
+            return url;
+        };
+
+        // Decrypted text keyed by ciphertext, so replaying history on a room switch is a lookup
+        const DECRYPT_CACHE_LIMIT = 500;
+        const decryptCache = new Map();
+        const rememberDecrypted = (cipherText, plain) => {
+            // Map iterates in insertion order, so the first key is the oldest entry
+            if (decryptCache.size >= DECRYPT_CACHE_LIMIT) decryptCache.delete(decryptCache.keys().next().value);
+            decryptCache.set(cipherText, plain);
+        };
+
+        // --- Crypto Worker ---
+        // Decryption runs in a dedicated worker built from the crypto-core script, so a history
+        // replay never blocks paint. Without worker support it falls back to the main thread.
+        const WORKER_SOURCE = `
+            self.onmessage = async ({ data }) => {
+                // Always answer, so the page never waits on a batch; null asks it to decrypt the batch itself
+                let texts = null;
+                try { texts = await decryptItems(data.items); } catch (e) {}
+                self.postMessage({ id: data.id, texts });
+            };
+        `;
+        const decryptOnMainThread = (items) => decryptItems(items)
+            .catch(() => items.map(() => "**Encrypted Data**"));
+        const pendingBatches = new Map();
+        let nextBatchId = 0;
+        let cryptoWorker = null;
+        try {
+            const source = document.getElementById('crypto-core').textContent + WORKER_SOURCE;
+            cryptoWorker = new Worker(URL.createObjectURL(new Blob([source], { type: 'text/javascript' })));
+            cryptoWorker.onmessage = ({ data }) => {
+                const { items, resolve } = pendingBatches.get(data.id);
+                pendingBatches.delete(data.id);
+                if (data.texts) resolve(data.texts);
+                else decryptOnMainThread(items).then(resolve);
+            };
+            cryptoWorker.onerror = () => {
+                // Give up on the worker and finish whatever it still owed on the main thread
+                cryptoWorker = null;
+                pendingBatches.forEach(({ items, resolve }) => decryptOnMainThread(items).then(resolve));
+                pendingBatches.clear();
+            };
+        } catch (e) { cryptoWorker = null; }
+
+        // Decrypt a batch of {text, room} items in one worker round trip
+        const decryptBatch = (items) => {
+            if (!cryptoWorker) return decryptOnMainThread(items);
+            return new Promise(resolve => {
+                const id = ++nextBatchId;
+                pendingBatches.set(id, { items, resolve });
+                cryptoWorker.postMessage({ id, items });
+            });
+        };
+
+        // Bubbles waiting for plaintext; everything appended in the same task is sent as one batch
+        let pendingDecrypts = [];
+        const queueDecrypt = (cipherText, room, bubble) => {
+            if (!pendingDecrypts.length) queueMicrotask(flushDecrypts);
+            pendingDecrypts.push({ cipherText, room, bubble });
+        };
+
+        async function flushDecrypts() {
+            const batch = pendingDecrypts;
+            pendingDecrypts = [];
+            const texts = await decryptBatch(batch.map(({ cipherText, room }) => ({ text: cipherText, room })));
+            batch.forEach(({ cipherText, bubble }, i) => {
+                rememberDecrypted(cipherText, texts[i]);
+                bubble.innerHTML = texts[i];
+            });
+            scheduleScroll();
+        }
+
         // --- UI Logic ---
         lucide.createIcons();
 
@@ -215,33 +590,57 @@ HTML_TEMPLATE = """
             
             // Setup User UI
             document.getElementById('display-username').textContent = currentUser;
-            document.getElementById('user-avatar').src = `https://api.dicebear.com/7.x/avataaars/svg?seed=${currentUser}`;
+            document.getElementById('user-avatar').src = avatarFor(currentUser);
             
-            joinRoom('general');
             renderRooms();
+            joinRoom('general');
         });
 
         // Room Switching
+        const ROOM_ACTIVE_CLASSES = ['bg-blue-600', 'text-white', 'shadow-md'];
+        const ROOM_IDLE_CLASSES = ['text-slate-400', 'hover:bg-slate-700'];
+
+        // The channel list is built once at login; switching rooms only swaps classes
         function renderRooms() {
             const container = document.getElementById('room-list');
             container.innerHTML = rooms.map(room => `
-                <button onclick="joinRoom('${room}')" class="w-full flex items-center gap-3 px-3 py-2 rounded-lg transition-all ${activeRoom === room ? 'bg-blue-600 text-white shadow-md' : 'text-slate-400 hover:bg-slate-700'}">
+                <button data-room="${room}" class="w-full flex items-center gap-3 px-3 py-2 rounded-lg transition-all">
                     <i data-lucide="hash" class="w-4 h-4"></i> ${room.charAt(0).toUpperCase() + room.slice(1)}
                 </button>
             `).join('');
             lucide.createIcons();
+            highlightActiveRoom();
         }
 
+        function highlightActiveRoom() {
+            document.querySelectorAll('#room-list [data-room]').forEach(button => {
+                const isActive = button.dataset.room === activeRoom;
+                button.classList.remove(...(isActive ? ROOM_IDLE_CLASSES : ROOM_ACTIVE_CLASSES));
+                button.classList.add(...(isActive ? ROOM_ACTIVE_CLASSES : ROOM_IDLE_CLASSES));
+            });
+        }
+
+        // A single delegated listener, so the buttons never need handlers of their own
+        document.getElementById('room-list').addEventListener('click', (e) => {
+            const button = e.target.closest('[data-room]');
+            if (button) joinRoom(button.dataset.room);
+        });
+
         function joinRoom(room) {
-            if (currentUser) {
-                socket.emit('leave', { username: currentUser, room: activeRoom });
-                document.getElementById('messages-container').innerHTML = ''; // Clear chat
+            if (room === joinedRoom) return; // already subscribed; nothing to leave or reload
+            if (joinedRoom) {
+                socket.emit('leave', { username: currentUser, room: joinedRoom });
+                document.getElementById('message-list').innerHTML = ''; // Clear chat
             }
+            // Follow the history replay from the bottom. This also covers the first join, where the
+            // observer has just reported the sentinel as hidden because the app was still hidden.
+            atBottom = true;
             activeRoom = room;
             document.getElementById('current-room-name').textContent = room;
             document.getElementById('message-input').placeholder = `Message #${room}...`;
             socket.emit('join', { username: currentUser, room: activeRoom });
-            renderRooms();
+            joinedRoom = room;
+            highlightActiveRoom();
         }
 
         // Encryption Toggle
@@ -264,53 +663,121 @@ HTML_TEMPLATE = """
         });
 
         // Sending Messages
-        document.getElementById('message-form').addEventListener('submit', (e) => {
+        document.getElementById('message-form').addEventListener('submit', async (e) => {
             e.preventDefault();
             const input = document.getElementById('message-input');
             const text = input.value.trim();
             if(!text) return;
 
-            const finalPayload = isEncrypted ? pseudoEncrypt(text) : text;
+            // Capture the target before awaiting the cipher, in case the user switches room meanwhile
+            const room = activeRoom;
+            const encrypted = isEncrypted;
+            let finalPayload = text;
+            if (encrypted) {
+                try {
+                    finalPayload = await encryptMessage(text, room);
+                } catch (err) {
+                    // Keep the text in the input so the user can retry
+                    console.error('Encryption failed; message not sent', err);
+                    return;
+                }
+            }
             
             socket.emit('send_message', {
                 text: finalPayload,
                 sender: currentUser,
-                room: activeRoom,
-                isEncrypted: isEncrypted,
-                avatar: `https://api.dicebear.com/7.x/avataaars/svg?seed=${currentUser}`
+                room: room,
+                isEncrypted: encrypted
             });
-            input.value = '';
+            // Cleared only once sent, and only if the user has not started typing the next message
+            if (input.value.trim() === text) input.value = '';
         });
 
         // Receiving Messages
-        function appendMessage(msg) {
-            const container = document.getElementById('messages-container');
-            const isMe = msg.sender === currentUser;
-            const displayText = msg.isEncrypted ? pseudoDecrypt(msg.text) : msg.text;
-
-            const html = `
-                <div class="flex gap-4 ${isMe ? 'flex-row-reverse' : ''}">
-                    <img src="${msg.avatar}" class="w-8 h-8 rounded-full bg-slate-700 mt-1 border border-slate-600">
+        // Markup for a single message; only takes flat, already-decrypted values
+        function renderMessage({ text, isMe, avatar, sender, timestamp, isEncrypted }) {
+            return `
+                <div class="message-row flex gap-4 ${isMe ? 'flex-row-reverse' : ''}">
+                    <img src="${avatar}" loading="lazy" decoding="async" class="w-8 h-8 rounded-full bg-slate-700 mt-1 border border-slate-600">
                     <div class="max-w-[70%] flex flex-col ${isMe ? 'items-end' : 'items-start'}">
                         <div class="flex items-center gap-2 mb-1">
-                            <span class="text-xs font-bold text-slate-300">${msg.sender}</span>
-                            <span class="text-[10px] text-slate-500">${msg.timestamp || ''}</span>
-                            ${msg.isEncrypted ? '<i data-lucide="lock" class="w-3 h-3 text-green-500"></i>' : ''}
+                            <span class="text-xs font-bold text-slate-300">${sender}</span>
+                            <span class="text-[10px] text-slate-500">${timestamp || ''}</span>
+                            ${isEncrypted ? '<i data-lucide="lock" class="w-3 h-3 text-green-500"></i>' : ''}
                         </div>
-                        <div class="p-3 rounded-2xl text-sm shadow-sm leading-relaxed break-words ${isMe ? 'bg-blue-600 text-white rounded-tr-none' : 'bg-slate-700 text-slate-200 rounded-tl-none'}">
-                            ${displayText}
+                        <div class="p-3 rounded-2xl text-sm shadow-sm leading-relaxed break-words ${isMe ? 'bg-blue-600 text-white rounded-tr-none' : 'bg-slate-700 text-slate-200 rounded-tl-none'}" data-message-text>
+                            ${text}
                         </div>
                     </div>
                 </div>
             `;
+        }
+
+        // Appends a batch of messages with a single DOM insertion
+        function appendMessages(msgs) {
+            const container = document.getElementById('message-list');
+            const first = container.children.length;
+            // Cached plaintext renders immediately; otherwise the bubble is filled once decryption resolves
+            const texts = msgs.map(msg => msg.isEncrypted ? decryptCache.get(msg.text) : msg.text);
+            const html = msgs.map((msg, i) => renderMessage({
+                text: texts[i] ?? 'Decrypting...',
+                isMe: msg.sender === currentUser,
+                avatar: avatarFor(msg.sender),
+                sender: msg.sender,
+                timestamp: msg.timestamp,
+                isEncrypted: !!msg.isEncrypted
+            })).join('');
             container.insertAdjacentHTML('beforeend', html);
-            container.scrollTop = container.scrollHeight;
-            lucide.createIcons();
+            msgs.forEach((msg, i) => {
+                if (msg.isEncrypted && texts[i] === undefined) {
+                    const bubble = container.children[first + i].querySelector('[data-message-text]');
+                    queueDecrypt(msg.text, msg.room, bubble);
+                }
+            });
+            scheduleScroll();
+        }
+
+        const appendMessage = (msg) => appendMessages([msg]);
+
+        // Only follow new messages while the end-of-chat sentinel is (nearly) in view, so reading
+        // older messages is never interrupted. The observer runs off the scroll path.
+        let atBottom = true;
+        new IntersectionObserver(([entry]) => { atBottom = entry.isIntersecting; }, {
+            root: document.getElementById('messages-container'),
+            rootMargin: '0px 0px 120px 0px'
+        }).observe(document.getElementById('messages-end'));
+
+        // Coalesce scrolling and icon hydration into one animation frame, however many messages arrive in it
+        let pendingFrame = 0;
+        function scheduleScroll() {
+            if (pendingFrame) return;
+            pendingFrame = requestAnimationFrame(() => {
+                pendingFrame = 0;
+                if (atBottom) {
+                    const container = document.getElementById('messages-container');
+                    container.scrollTop = container.scrollHeight;
+                }
+                lucide.createIcons();
+            });
         }
 
         // Socket Listeners
-        socket.on('load_history', (msgs) => {
-            msgs.forEach(appendMessage);
+        // The server forgets room membership with the old connection, so resubscribe after a
+        // reconnect (and replay the history from scratch) instead of trusting joinedRoom
+        socket.on('disconnect', () => {
+            joinedRoom = null;
+        });
+
+        socket.on('connect', () => {
+            if (!currentUser) return; // first connect happens before login
+            joinedRoom = null;
+            document.getElementById('message-list').innerHTML = '';
+            joinRoom(activeRoom);
+        });
+
+        // History arrives as one pre-serialized JSON array string
+        socket.on('load_history_raw', (raw) => {
+            appendMessages(JSON.parse(raw));
         });
 
         socket.on('receive_message', (msg) => {
@@ -327,6 +794,11 @@ HTML_TEMPLATE = """
 </html>
 """
 
+INDEX_HTML = HTML_TEMPLATE.encode('utf-8')
+INDEX_HTML_GZIP = gzip.compress(INDEX_HTML)
+
 if __name__ == '__main__':
     print("Starting Python SecureChat on http://127.0.0.1:5000")
-    socketio.run(app, debug=True)
+    # The Werkzeug debugger, reloader and per-request logging are opt-in (FLASK_DEBUG=1)
+    debug = os.getenv('FLASK_DEBUG') == '1'
+    socketio.run(app, debug=debug, use_reloader=debug, log_output=debug)